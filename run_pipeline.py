@@ -13,11 +13,162 @@ Estructura de proyecto:
   run_pipeline.py
 """
 import os
-import glob
 import subprocess
 import argparse
 import logging
 import sys
+import importlib
+import contextlib
+import collections
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# La salida de los scripts se vuelca al log por bloques de 1 MiB en lugar de línea a línea
+LOG_BUFFER_SIZE = 1 << 20
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+# Código de salida de compute_geo_coords.py cuando la imagen no tiene EXIF GPS (su NO_GPS_EXIT_CODE)
+NO_GPS_EXIT_CODE = 3
+
+
+def process_image_subprocess(img, out_dir, log_f, args):
+    """Ejecuta cada paso en un intérprete aparte (modo --isolated, útil para depurar)"""
+    # 1. Cubemap
+    cmd1 = [sys.executable, os.path.join(args.scripts_dir,'convert_images.py'),
+            '-i', img, '-o', out_dir]
+    if args.cube_size:
+        cmd1 += ['-c', str(args.cube_size)]
+    try:
+        subprocess.run(cmd1, check=True, stdout=log_f, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error en convert_images.py: {e}")
+        return
+
+    # 2. Detección YOLO en caras del cubemap
+    cmd_detect = [sys.executable, os.path.join(args.scripts_dir,'analyze_faces.py'),
+                  '-f', out_dir, '-m', args.model]
+    if args.draw:
+        cmd_detect.append('--draw')
+    if args.engine:
+        cmd_detect.append('--engine')
+    try:
+        subprocess.run(cmd_detect, check=True, stdout=log_f, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error en analyze_faces.py: {e}")
+        return
+
+    # 3. Azimuths
+    det_json = os.path.join(out_dir, 'detections.json')
+    az_out = os.path.join(out_dir, 'azimuths.json')
+    cmd2 = [sys.executable, os.path.join(args.scripts_dir,'calculate_azimuths.py'),
+            '-i', img, '-d', det_json, '-o', az_out]
+    try:
+        subprocess.run(cmd2, check=True, stdout=log_f, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error en calculate_azimuths.py: {e}")
+        return
+
+    # 4. Distancias
+    dist_out = os.path.join(out_dir, 'distances.json')
+    cmd3 = [sys.executable, os.path.join(args.scripts_dir,'estimate_distances.py'),
+            '-d', det_json, '-f', out_dir, '-o', dist_out,
+            '--version', args.version, '--backbone', args.backbone]
+    try:
+        subprocess.run(cmd3, check=True, stdout=log_f, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error en estimate_distances.py: {e}")
+        return
+
+    # 5. Coordenadas GPS
+    coords_out = os.path.join(out_dir, 'coords.json')
+    cmd4 = [sys.executable, os.path.join(args.scripts_dir,'compute_geo_coords.py'),
+            '-i', img, '-a', az_out, '-d', dist_out, '-o', coords_out]
+    try:
+        subprocess.run(cmd4, check=True, stdout=log_f, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        if e.returncode == NO_GPS_EXIT_CODE:
+            logging.warning(f"Sin EXIF GPS en {img}, se omiten coords")
+        else:
+            logging.error(f"Error en compute_geo_coords.py: {e}")
+    except Exception as e:
+        logging.error(f"Error en compute_geo_coords.py: {e}")
+
+
+def import_script(scripts_dir, name):
+    """Importa un script del pipeline como módulo"""
+    path = os.path.abspath(scripts_dir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return importlib.import_module(name)
+
+
+def load_modules(scripts_dir):
+    """Importa los scripts del pipeline como módulos"""
+    names = ['convert_images', 'analyze_faces', 'calculate_azimuths',
+             'estimate_distances', 'compute_geo_coords']
+    return {n: import_script(scripts_dir, n) for n in names}
+
+
+def load_models(modules, args):
+    """Carga YOLO y UniDepth una vez para todas las imágenes"""
+    device = modules['estimate_distances'].DEFAULT_DEVICE
+    logging.info(f"Cargando modelos (YOLO: {args.model}, UniDepth {args.version}/{args.backbone})")
+    return {
+        'yolo': modules['analyze_faces'].load_model(args.model, device, args.engine),
+        'unidepth': modules['estimate_distances'].load_unidepth(args.version, args.backbone, device),
+        'device': device,
+    }
+
+
+def open_log(log_path, mode, quiet=False):
+    """Abre el log de una imagen con un búfer grande (o os.devnull con --quiet)"""
+    if quiet:
+        return open(os.devnull, 'w')
+    return open(log_path, mode, buffering=LOG_BUFFER_SIZE)
+
+
+def convert_stage(scripts_dir, img, out_dir, cube_size, log_path, quiet=False, save_faces=False):
+    """
+    Paso de CPU (cubemap); se ejecuta en un proceso del pool y escribe el inicio del log.
+    Devuelve las caras en memoria ({nombre: array RGB}); solo se escriben a disco con save_faces
+    """
+    convert_images = import_script(scripts_dir, 'convert_images')
+    with open_log(log_path, 'w', quiet) as log_f, contextlib.redirect_stdout(log_f), contextlib.redirect_stderr(log_f):
+        faces = convert_images.CubemapBBoxConverter(img, out_dir, cube_size).extract_faces(save=save_faces)
+    if not faces:
+        raise RuntimeError("no se pudo generar el cubemap")
+    return faces
+
+
+def process_image(img, out_dir, log_f, args, modules, models, faces):
+    """Pasos de GPU y posteriores, en este proceso, con los modelos ya cargados y las caras en memoria"""
+    det_json = os.path.join(out_dir, 'detections.json')
+    az_out = os.path.join(out_dir, 'azimuths.json')
+    dist_out = os.path.join(out_dir, 'distances.json')
+    coords_out = os.path.join(out_dir, 'coords.json')
+    device = models['device']
+
+    steps = [
+        ('analyze_faces.py', lambda: modules['analyze_faces'].run(
+            out_dir, models['yolo'], device=device, draw=args.draw, faces=faces)),
+        ('calculate_azimuths.py', lambda: modules['calculate_azimuths'].run(img, det_json, az_out)),
+        ('estimate_distances.py', lambda: modules['estimate_distances'].run(
+            models['unidepth'], device, det_json, out_dir, dist_out, faces=faces)),
+    ]
+    with contextlib.redirect_stdout(log_f), contextlib.redirect_stderr(log_f):
+        for script, step in steps:
+            try:
+                step()
+            except Exception as e:
+                logging.error(f"Error en {script}: {e}")
+                return
+        try:
+            modules['compute_geo_coords'].run(img, az_out, dist_out, coords_out)
+        except modules['compute_geo_coords'].NoGPSError:
+            logging.warning(f"Sin EXIF GPS en {img}, se omiten coords")
+        except Exception as e:
+            logging.error(f"Error en compute_geo_coords.py: {e}")
 
 
 def main():
@@ -32,6 +183,18 @@ def main():
     parser.add_argument('--scripts-dir', default='scripts', help="Directorio de scripts Python")
     parser.add_argument('--output-root', default='outputs', help="Directorio raíz de salida (carpeta outputs)")
     parser.add_argument('--logs-dir', default='logs', help="Directorio raíz de logs (carpeta logs)")
+    parser.add_argument('--draw', action='store_true',
+                        help="Guardar las caras con las detecciones YOLO dibujadas")
+    parser.add_argument('--engine', action='store_true',
+                        help="Exportar (una vez) y usar un motor TensorRT FP16 del modelo YOLO (solo GPU)")
+    parser.add_argument('--save-faces', action='store_true',
+                        help="Guardar también las caras del cubemap como JPEG (siempre en modo --isolated)")
+    parser.add_argument('--isolated', action='store_true',
+                        help="Ejecutar cada script en un subproceso (recarga los modelos por imagen)")
+    parser.add_argument('-j','--workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help="Procesos que generan cubemaps en paralelo mientras la GPU detecta")
+    parser.add_argument('-q','--quiet', action='store_true',
+                        help="Descartar la salida de los scripts en lugar de guardarla en logs/")
     args = parser.parse_args()
     # Asegurar existencia de carpeta raíz de outputs
     os.makedirs(args.output_root, exist_ok=True)
@@ -49,73 +212,62 @@ def main():
             sys.exit(1)
         images = [img]
     else:
-        pattern = os.path.join(args.images_dir, '*')
-        images = [f for f in glob.glob(pattern)
-                  if os.path.isfile(f) and f.lower().endswith(('.jpg','.jpeg','.png'))]
-        images.sort()
+        # Una sola pasada por el directorio: is_file() reutiliza el tipo devuelto por scandir
+        with os.scandir(args.images_dir) as entries:
+            images = sorted(e.path for e in entries
+                            if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTENSIONS)
 
+    jobs = []
     for img in images:
         name = os.path.splitext(os.path.basename(img))[0]
         out_dir = os.path.join(args.output_root, f"output_{name}")
         os.makedirs(out_dir, exist_ok=True)
-        # Abrir log de la imagen
         log_path = os.path.join(args.logs_dir, f"logs_{name}.txt")
-        log_f = open(log_path, 'w')
-        logging.info(f"Procesando {img} → {out_dir}")
-
-        # 1. Cubemap
-        cmd1 = [sys.executable, os.path.join(args.scripts_dir,'convert_images.py'),
-                '-i', img, '-o', out_dir]
-        if args.cube_size:
-            cmd1 += ['-c', str(args.cube_size)]
-        try:
-            subprocess.run(cmd1, check=True, stdout=log_f, stderr=log_f)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error en convert_images.py: {e}")
-            continue
-
-                # 2. Detección YOLO en caras del cubemap
-        cmd_detect = [sys.executable, os.path.join(args.scripts_dir,'analyze_faces.py'),
-                '-f', out_dir, '-m', args.model]
-        try:
-            subprocess.run(cmd_detect, check=True, stdout=log_f, stderr=log_f)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error en analyze_faces.py: {e}")
-            continue
-
-        # 3. Azimuths
-        det_json = os.path.join(out_dir, 'detections.json')
-        az_out = os.path.join(out_dir, 'azimuths.json')
-        cmd2 = [sys.executable, os.path.join(args.scripts_dir,'calculate_azimuths.py'),
-                '-i', img, '-d', det_json, '-o', az_out]
-        try:
-            subprocess.run(cmd2, check=True, stdout=log_f, stderr=log_f)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error en calculate_azimuths.py: {e}")
-            continue
-
-                # 4. Distancias
-        dist_out = os.path.join(out_dir, 'distances.json')
-        cmd3 = [sys.executable, os.path.join(args.scripts_dir,'estimate_distances.py'),
-                '-d', det_json, '-f', out_dir, '-o', dist_out,
-                '--version', args.version, '--backbone', args.backbone]
-        try:
-            subprocess.run(cmd3, check=True, stdout=log_f, stderr=log_f)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error en estimate_distances.py: {e}")
-            continue
-
-                # 5. Coordenadas GPS
-        coords_out = os.path.join(out_dir, 'coords.json')
-        cmd4 = [sys.executable, os.path.join(args.scripts_dir,'compute_geo_coords.py'),
-                '-i', img, '-a', az_out, '-d', dist_out, '-o', coords_out]
-        try:
-            subprocess.run(cmd4, check=True, stdout=log_f, stderr=log_f)
-        except subprocess.CalledProcessError:
-            logging.warning(f"Sin EXIF GPS en {img}, se omiten coords")
-        except Exception as e:
-            logging.error(f"Error en compute_geo_coords.py: {e}")
-        log_f.close()
+        jobs.append((img, out_dir, log_path))
+
+    if args.isolated:
+        for img, out_dir, log_path in jobs:
+            logging.info(f"Procesando {img} → {out_dir}")
+            if args.quiet:
+                process_image_subprocess(img, out_dir, subprocess.DEVNULL, args)
+                continue
+            # Los hijos escriben directamente en el descriptor: stderr se une a stdout
+            with open(log_path, 'w') as log_f:
+                process_image_subprocess(img, out_dir, log_f, args)
+        logging.info("Pipeline finalizado.")
+        return
+
+    # Modo en proceso: los scripts se importan y los modelos se cargan una sola vez.
+    # Los cubemaps se generan en un pool de procesos mientras este proceso
+    # consume, en orden, las imágenes listas para YOLO/UniDepth. Las caras llegan
+    # en memoria, sin pasar por JPEG en disco.
+    modules = load_modules(args.scripts_dir)
+    models = load_models(modules, args)
+    workers = max(1, args.workers)
+    # 'spawn' evita heredar el contexto CUDA ya inicializado en los hijos
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        def submit(job):
+            img, out_dir, log_path = job
+            return pool.submit(convert_stage, args.scripts_dir, img, out_dir,
+                               args.cube_size, log_path, args.quiet, args.save_faces)
+
+        # Como mucho 'workers' cubemaps por delante: cada uno ocupa 6 caras en RAM
+        jobs_iter = iter(jobs)
+        pending = collections.deque((job, submit(job)) for job in itertools.islice(jobs_iter, workers))
+        while pending:
+            (img, out_dir, log_path), future = pending.popleft()
+            next_job = next(jobs_iter, None)
+            if next_job is not None:
+                pending.append((next_job, submit(next_job)))
+            logging.info(f"Procesando {img} → {out_dir}")
+            try:
+                faces = future.result()
+            except Exception as e:
+                logging.error(f"Error en convert_images.py: {e}")
+                continue
+            with open_log(log_path, 'a', args.quiet) as log_f:
+                process_image(img, out_dir, log_f, args, modules, models, faces)
 
     logging.info("Pipeline finalizado.")
 
@@ -6,95 +6,182 @@ Script para ejecutar detección YOLO en imágenes de caras de cubemap generadas
 import os
 import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+import torch
+import cv2
+from PIL import Image
 from ultralytics import YOLO
 
-def main():
-    parser = argparse.ArgumentParser(description="YOLO detection on cubemap faces")
-    parser.add_argument("-f", "--faces-dir", required=True, help="Directorio con caras del cubemap (.jpg)")
-    parser.add_argument("-m", "--model", default="best.pt", help="Ruta al modelo YOLO (.pt)")
-    parser.add_argument("-o", "--output-dir", default=None, help="Directorio de salida (por defecto faces-dir)")
-    args = parser.parse_args()
+try:
+    import orjson
+except ImportError:  # Sin orjson se usa el codificador de la librería estándar
+    orjson = None
+
+DEFAULT_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+FACE_NAMES = ("front", "right", "back", "left", "up", "down")
+COLORS = (
+    (255, 0, 0),    # Rojo
+    (0, 255, 0),    # Verde
+    (0, 0, 255),    # Azul
+    (255, 255, 0),  # Amarillo
+    (255, 0, 255),  # Magenta
+    (0, 255, 255),  # Cian
+)
+TEXT_CHAR_W = 6  # Ancho aproximado por carácter de la etiqueta (FONT_HERSHEY_SIMPLEX a escala 0.35)
+
+def draw_detections(src, boxes_with_data, out_img):
+    """
+    Dibuja las detecciones sobre una cara (array RGB o ruta .jpg) y la guarda en out_img
+    """
+    if isinstance(src, str):
+        arr = np.array(Image.open(src).convert("RGB"))
+    else:
+        arr = src.copy()
+    h, w = arr.shape[:2]
+    for box_data in boxes_with_data:
+        x1, y1, x2, y2 = (int(round(v)) for v in box_data["coordinates"])
+        x1, x2 = max(0, x1), min(w - 1, x2)
+        y1, y2 = max(0, y1), min(h - 1, y2)
+        cls = box_data["class"]
+        score = box_data["score"]
+        color = COLORS[cls % len(COLORS)]
+        # Rectángulo de 3 px con asignaciones por slices
+        arr[y1:y1 + 3, x1:x2 + 1] = color
+        arr[max(y1, y2 - 2):y2 + 1, x1:x2 + 1] = color
+        arr[y1:y2 + 1, x1:x1 + 3] = color
+        arr[y1:y2 + 1, max(x1, x2 - 2):x2 + 1] = color
+        text = f"{cls}: {score:.2f}"
+        tx, ty = x1, max(0, y1 - 10)
+        # Fondo para legibilidad
+        arr[ty:ty + 12, tx:tx + len(text)*TEXT_CHAR_W] = 0
+        cv2.putText(arr, text, (tx, ty + 10), cv2.FONT_HERSHEY_SIMPLEX, 0.35, color, 1)
+    Image.fromarray(arr).save(out_img, quality=85, optimize=False)
+    return out_img
+
+def load_model(model_path, device=DEFAULT_DEVICE, engine=False):
+    """
+    Carga el modelo YOLO; con engine=True en GPU exporta (una vez) y usa un motor TensorRT FP16
+    con lote dinámico de hasta 6 caras, guardado junto al .pt
+    """
+    if model_path.endswith(".engine") or not engine:
+        return YOLO(model_path)
+    if not device.startswith("cuda"):
+        print("Aviso: TensorRT requiere GPU; se usa el modelo .pt")
+        return YOLO(model_path)
+
+    engine_path = os.path.splitext(model_path)[0] + ".engine"
+    if not os.path.isfile(engine_path) or os.path.getmtime(engine_path) < os.path.getmtime(model_path):
+        print(f"Exportando {model_path} a TensorRT FP16...")
+        engine_path = YOLO(model_path).export(format="engine", half=True, dynamic=True,
+                                              batch=len(FACE_NAMES), device=device)
+    return YOLO(engine_path, task="detect")
+
+def run(faces_dir, model, output_dir=None, device=DEFAULT_DEVICE, draw=False, faces=None):
+    """
+    Ejecuta la detección sobre las caras de faces_dir con un modelo YOLO ya cargado
+    y guarda detections.json en output_dir (y las caras anotadas si draw=True)
 
-    faces_dir = args.faces_dir
-    model_path = args.model
-    output_dir = args.output_dir or faces_dir
+    Si se pasa faces ({nombre_cara: array RGB}) se usan esas caras en memoria
+    en lugar de leer los .jpg de faces_dir
+    """
+    output_dir = output_dir or faces_dir
     os.makedirs(output_dir, exist_ok=True)
 
-    face_names = ["front", "right", "back", "left", "up", "down"]
-    colors = [
-        (255, 0, 0),    # Rojo
-        (0, 255, 0),    # Verde
-        (0, 0, 255),    # Azul
-        (255, 255, 0),  # Amarillo
-        (255, 0, 255),  # Magenta
-        (0, 255, 255),  # Cian
-    ]
-
-    print(f"Iniciando detección YOLO con modelo: {model_path}")
-    model = YOLO(model_path)
     detections = {}
+    draw_jobs = []
 
-    for idx, face_name in enumerate(face_names):
+    # Una sola predicción por lotes sobre todas las caras disponibles
+    sources = {}
+    for face_name in FACE_NAMES:
+        if faces is not None:
+            if face_name in faces:
+                # Ultralytics interpreta los arrays como BGR
+                sources[face_name] = cv2.cvtColor(faces[face_name], cv2.COLOR_RGB2BGR)
+            continue
+        face_path = os.path.join(faces_dir, f"{face_name}.jpg")
+        if os.path.isfile(face_path):
+            sources[face_name] = face_path
+    results_by_face = {}
+    if sources:
+        results = model.predict(source=list(sources.values()), batch=len(sources),
+                                device=device, half=device.startswith("cuda"),
+                                save=False, save_txt=False, verbose=False)
+        results_by_face = dict(zip(sources, results))
+
+    for idx, face_name in enumerate(FACE_NAMES):
         face_file = f"{face_name}.jpg"
         face_path = os.path.join(faces_dir, face_file)
-        if not os.path.isfile(face_path):
+        if face_name not in sources:
             print(f"Warning: no se encontró {face_path}")
             detections[face_name] = {"boxes": [], "num_detections": 0}
             continue
 
         print(f"Procesando cara {idx}: {face_file}")
-        results = model.predict(source=face_path, save=False, save_txt=False, verbose=False)
-        if results and hasattr(results[0], "boxes") and results[0].boxes is not None:
-            boxes = results[0].boxes.xyxy.cpu().numpy()
-            scores = results[0].boxes.conf.cpu().numpy()
-            classes = results[0].boxes.cls.cpu().numpy()
+        result = results_by_face.get(face_name)
+        if result is not None and hasattr(result, "boxes") and result.boxes is not None:
+            # Una sola copia GPU->CPU: data = [x1, y1, x2, y2, (track_id), conf, cls]
+            data = result.boxes.data.cpu().numpy()
+            boxes = data[:, :4]
+            scores = data[:, -2]
+            classes = data[:, -1]
         else:
             boxes = np.array([])
             scores = np.array([])
             classes = np.array([])
 
         # Crear lista de boxes con scores y classes incluidos
-        boxes_with_data = []
-        for i in range(len(boxes)):
-            box_data = {
-                "coordinates": boxes[i].tolist(),
-                "score": float(scores[i]),
-                "class": int(classes[i])
-            }
-            boxes_with_data.append(box_data)
+        boxes_with_data = [
+            {"coordinates": box, "score": score, "class": int(cls)}
+            for box, score, cls in zip(boxes.tolist(), scores.tolist(), classes.tolist())
+        ]
         
         detections[face_name] = {
             "boxes": boxes_with_data,
             "num_detections": int(len(boxes))
         }
 
-        # Dibujar y guardar imagen con detecciones
-        if len(boxes_with_data) > 0:
-            img = Image.open(face_path)
-            draw = ImageDraw.Draw(img)
-            font = ImageFont.load_default()
-            for box_data in boxes_with_data:
-                x1, y1, x2, y2 = box_data["coordinates"]
-                cls = box_data["class"]
-                score = box_data["score"]
-                color = colors[cls % len(colors)]
-                draw.rectangle([x1, y1, x2, y2], outline=color, width=3)
-                text = f"{cls}: {score:.2f}"
-                text_pos = (x1, max(0, y1 - 10))
-                # Fondo para legibilidad
-                draw.rectangle([text_pos, (text_pos[0] + len(text)*6, text_pos[1] + 12)], fill=(0, 0, 0, 128))
-                draw.text(text_pos, text, fill=color, font=font)
+        # Dibujar y guardar imagen con detecciones (solo con --draw)
+        if draw and len(boxes_with_data) > 0:
+            src = faces[face_name] if faces is not None else face_path
             out_img = os.path.join(output_dir, f"{face_name}_with_detections.jpg")
-            img.save(out_img, quality=95)
-            print(f"  -> Guardado {out_img}")
+            draw_jobs.append((src, boxes_with_data, out_img))
+
+    # Las caras anotadas son independientes: la decodificación, el dibujo con NumPy/OpenCV
+    # y la codificación JPEG liberan el GIL, así que se procesan en paralelo
+    if draw_jobs:
+        with ThreadPoolExecutor(max_workers=min(len(draw_jobs), os.cpu_count() or 1)) as executor:
+            for out_img in executor.map(lambda job: draw_detections(*job), draw_jobs):
+                print(f"  -> Guardado {out_img}")
 
     # Guardar JSON de detecciones
     json_path = os.path.join(output_dir, "detections.json")
-    with open(json_path, "w") as f:
-        json.dump(detections, f, indent=2)
+    if orjson is not None:
+        with open(json_path, "wb") as f:
+            f.write(orjson.dumps(detections, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+    else:
+        with open(json_path, "w") as f:
+            json.dump(detections, f, separators=(',', ':'))
     print(f"Detecciones guardadas en: {json_path}")
+    return detections
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLO detection on cubemap faces")
+    parser.add_argument("-f", "--faces-dir", required=True, help="Directorio con caras del cubemap (.jpg)")
+    parser.add_argument("-m", "--model", default="best.pt", help="Ruta al modelo YOLO (.pt)")
+    parser.add_argument("-o", "--output-dir", default=None, help="Directorio de salida (por defecto faces-dir)")
+    parser.add_argument("--device", default=DEFAULT_DEVICE,
+                        help="Dispositivo de inferencia (FP16 en GPU, FP32 en CPU)")
+    parser.add_argument("--draw", action="store_true",
+                        help="Guardar también las caras con las detecciones dibujadas")
+    parser.add_argument("--engine", action="store_true",
+                        help="Exportar/usar un motor TensorRT FP16 junto al .pt (solo GPU)")
+    args = parser.parse_args()
+
+    print(f"Iniciando detección YOLO con modelo: {args.model}")
+    model = load_model(args.model, args.device, args.engine)
+    run(args.faces_dir, model, args.output_dir, args.device, args.draw)
 
 if __name__ == '__main__':
     main()
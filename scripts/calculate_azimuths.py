@@ -2,7 +2,23 @@
 import json
 import argparse
 from math import atan2, degrees
+import numpy as np
 from PIL import Image
+# Per-face rotation (6, 3, 3) shared with the cubemap conversion
+from cube_faces import FACE_AXES
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+try:
+    from numba import njit, prange
+except ImportError:  # without numba the batch kernel runs as a plain Python loop
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 # Map face indices to names
 FACE_NAMES = ["front", "right", "back", "left", "up", "down"]
@@ -36,48 +52,80 @@ def compute_azimuth(face, i, j, cube_size):
     return deg
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Compute azimuths of YOLO detections in a cubemap.")
-    parser.add_argument("-i", "--image", required=True, help="Path to the equirectangular 360° image.")
-    parser.add_argument("-d", "--detections", required=True, help="Path to detections.json.")
-    parser.add_argument("-o", "--output", help="Output JSON file for azimuths.", default=None)
-    args = parser.parse_args()
+@njit(cache=True, parallel=True, fastmath=True)
+def _azimuths_batch(faces, cxs, cys, cube_size):
+    """Azimuths (deg) for many face points at once; same math as compute_azimuth."""
+    out = np.empty(faces.shape[0], dtype=np.float64)
+    for k in prange(faces.shape[0]):
+        r = FACE_AXES[faces[k]]
+        a = 2.0 * cxs[k] / cube_size - 1.0
+        b = 1.0 - 2.0 * cys[k] / cube_size
+        x = r[0, 0] * a + r[0, 1] * b + r[0, 2]
+        z = r[2, 0] * a + r[2, 1] * b + r[2, 2]
+        deg = degrees(atan2(x, z))
+        if deg < 0:
+            deg += 360.0
+        out[k] = deg
+    return out
 
+
+def run(image_path, detections_path, output_path=None):
+    """Compute azimuths for detections_path; write them to output_path or stdout."""
     # Load image to get dimensions and cube size
-    img = Image.open(args.image)
+    img = Image.open(image_path)
     width, height = img.size
     cube_size = width // 4
 
     # Load detections
-    with open(args.detections, 'r') as f:
+    with open(detections_path, 'r') as f:
         dets = json.load(f)
 
+    # Flatten all detections so the azimuths are computed in a single batch
     result = {}
+    entries = []
+    faces, cxs, cys = [], [], []
     for face_str, data in dets.items():
         face = int(face_str)
         face_name = FACE_NAMES[face]
         boxes = data.get('boxes', [])
         classes = data.get('classes', [])
-        az_list = []
+        result[face_name] = []
         for idx, bbox in enumerate(boxes):
             x1, y1, x2, y2 = bbox
-            cx = (x1 + x2) / 2.0
-            cy = (y1 + y2) / 2.0
-            az = compute_azimuth(face, cx, cy, cube_size)
-            az_list.append({
-                'bbox_index': idx,
-                'class_id': classes[idx] if idx < len(classes) else None,
-                'azimuth_deg': az
-            })
-        result[face_name] = az_list
-
-    output_str = json.dumps(result, indent=2)
-    if args.output:
-        with open(args.output, 'w') as f:
+            faces.append(face)
+            cxs.append((x1 + x2) / 2.0)
+            cys.append((y1 + y2) / 2.0)
+            entries.append((face_name, idx, classes[idx] if idx < len(classes) else None))
+
+    azimuths = _azimuths_batch(np.array(faces, dtype=np.int32), np.array(cxs, dtype=np.float64),
+                               np.array(cys, dtype=np.float64), cube_size)
+    for (face_name, idx, class_id), az in zip(entries, azimuths):
+        result[face_name].append({
+            'bbox_index': idx,
+            'class_id': class_id,
+            'azimuth_deg': float(az)
+        })
+
+    if orjson is not None:
+        output_str = orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY).decode()
+    else:
+        output_str = json.dumps(result, separators=(',', ':'))
+    if output_path:
+        with open(output_path, 'w') as f:
             f.write(output_str)
-        print(f"Azimuths saved to {args.output}")
+        print(f"Azimuths saved to {output_path}")
     else:
         print(output_str)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute azimuths of YOLO detections in a cubemap.")
+    parser.add_argument("-i", "--image", required=True, help="Path to the equirectangular 360° image.")
+    parser.add_argument("-d", "--detections", required=True, help="Path to detections.json.")
+    parser.add_argument("-o", "--output", help="Output JSON file for azimuths.", default=None)
+    args = parser.parse_args()
+    run(args.image, args.detections, args.output)
 
 if __name__ == '__main__':
     main()
@@ -3,23 +3,58 @@
 compute_geo_coords.py
 Compute GPS coordinates of detected objects given azimuth and distance.
 """
+import sys
 import json
 import math
 import argparse
+from pathlib import Path
+import numpy as np
 from PIL import Image, ExifTags
 
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+
+class NoGPSError(ValueError):
+    """The image has no GPS EXIF data, so coordinates cannot be computed."""
+
+
+# Exit status of the CLI when the image has no GPS EXIF (1 is any other error)
+NO_GPS_EXIT_CODE = 3
+
+
 def destination_point(lat1, lon1, bearing_deg, distance_m, R=6371000):
-    # Computes lat2, lon2 given start coords, bearing, and distance
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    theta = math.radians(bearing_deg)
-    dr = distance_m / R
-    lat2 = math.asin(math.sin(lat1_rad)*math.cos(dr) + math.cos(lat1_rad)*math.sin(dr)*math.cos(theta))
-    lon2 = lon1_rad + math.atan2(
-        math.sin(theta)*math.sin(dr)*math.cos(lat1_rad),
-        math.cos(dr) - math.sin(lat1_rad)*math.sin(lat2)
+    # Computes lat2, lon2 given start coords, bearing, and distance (scalar wrapper)
+    lat2, lon2 = destination_point_vec(*start_point_constants(lat1, lon1), bearing_deg, distance_m, R)
+    return float(lat2), float(lon2)
+
+
+def destination_point_vec(sin_lat1, cos_lat1, lon1_rad, bearings_deg, distances_m, R=6371000):
+    # Vectorized destination_point: one start point, arrays of bearings/distances
+    theta = np.radians(np.asarray(bearings_deg, dtype=np.float64))
+    dr = np.asarray(distances_m, dtype=np.float64) / R
+    sin_dr, cos_dr = np.sin(dr), np.cos(dr)
+    sin_lat2 = sin_lat1*cos_dr + cos_lat1*sin_dr*np.cos(theta)
+    lat2 = np.arcsin(sin_lat2)
+    lon2 = lon1_rad + np.arctan2(
+        np.sin(theta)*sin_dr*cos_lat1,
+        cos_dr - sin_lat1*sin_lat2
     )
-    return math.degrees(lat2), math.degrees(lon2)
+    return np.degrees(lat2), np.degrees(lon2)
+
+
+def start_point_constants(lat1, lon1):
+    # Trig terms of the start point shared by every destination_point_vec call
+    lat1_rad = math.radians(lat1)
+    return math.sin(lat1_rad), math.cos(lat1_rad), math.radians(lon1)
+
+
+def load_json(path):
+    # Single read of the whole file; the handle is closed right away
+    data = Path(path).read_bytes()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
 
 
 def extract_gps_from_exif(image_path):
@@ -27,7 +62,7 @@ def extract_gps_from_exif(image_path):
     img = Image.open(image_path)
     exif = img._getexif()
     if not exif or 34853 not in exif:
-        raise ValueError(f'No GPS EXIF data found in {image_path}')
+        raise NoGPSError(f'No GPS EXIF data found in {image_path}')
     gps_info = exif[34853]
     gps_data = {}
     for key, val in gps_info.items():
@@ -55,43 +90,63 @@ def extract_gps_from_exif(image_path):
         lon = -lon
     return lat, lon
 
-def main():
-    parser = argparse.ArgumentParser(description="Compute geo coordinates from azimuths and distances.")
-    parser.add_argument("-a", "--azimuths", default="cubemap_output/azimuths.json", help="Azimuths JSON file.")
-    parser.add_argument("-d", "--distances", default="cubemap_output/distances_unidepth.json", help="Distances JSON file.")
-    parser.add_argument('-i','--image',required=True,help='Equirectangular image with GPS EXIF.')
-    parser.add_argument("-o", "--output", default="cubemap_output/coords.json", help="Output JSON file.")
-    args = parser.parse_args()
-    lat1, lon1 = extract_gps_from_exif(args.image)
+def run(image_path, azimuths_path, distances_path, output_path):
+    '''Compute coords.json; raises NoGPSError if the image has no GPS EXIF'''
+    lat1, lon1 = extract_gps_from_exif(image_path)
+    sin_lat1, cos_lat1, lon1_rad = start_point_constants(lat1, lon1)
 
-    az = json.load(open(args.azimuths))
-    dist = json.load(open(args.distances))
+    az = load_json(azimuths_path)
+    dist = load_json(distances_path)
 
     results = {}
     for face, items in az.items():
-        face_out = []
+        dist_by_idx = {d.get('bbox_index'): d.get('distance_m') for d in dist.get(face, [])}
+        matched = []
         for item in items:
-            idx = item.get('bbox_index')
-            azimuth = item.get('azimuth_deg')
             # find matching distance
-            dval = next((d.get('distance_m') for d in dist.get(face, []) if d.get('bbox_index') == idx), None)
+            dval = dist_by_idx.get(item.get('bbox_index'))
             if dval is None:
                 continue
-            lat2, lon2 = destination_point(lat1, lon1, azimuth, dval)
+            matched.append((item, dval))
+
+        # one vectorized call per face
+        lats, lons = destination_point_vec(sin_lat1, cos_lat1, lon1_rad,
+                                           [item.get('azimuth_deg') for item, _ in matched],
+                                           [dval for _, dval in matched])
+        face_out = []
+        for (item, dval), lat2, lon2 in zip(matched, lats, lons):
             face_out.append({
-                'bbox_index': idx,
+                'bbox_index': item.get('bbox_index'),
                 'class_id': item.get('class_id'),
                 'score': item.get('score'),
-                'azimuth_deg': azimuth,
+                'azimuth_deg': item.get('azimuth_deg'),
                 'distance_m': dval,
-                'latitude': lat2,
-                'longitude': lon2
+                'latitude': float(lat2),
+                'longitude': float(lon2)
             })
         results[face] = face_out
 
-    with open(args.output, 'w') as f:
-        json.dump(results, f, indent=2)
-    print(f"Saved coordinates to {args.output}")
+    if orjson is not None:
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+    else:
+        with open(output_path, 'w') as f:
+            json.dump(results, f, separators=(',', ':'))
+    print(f"Saved coordinates to {output_path}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute geo coordinates from azimuths and distances.")
+    parser.add_argument("-a", "--azimuths", default="cubemap_output/azimuths.json", help="Azimuths JSON file.")
+    parser.add_argument("-d", "--distances", default="cubemap_output/distances_unidepth.json", help="Distances JSON file.")
+    parser.add_argument('-i','--image',required=True,help='Equirectangular image with GPS EXIF.')
+    parser.add_argument("-o", "--output", default="cubemap_output/coords.json", help="Output JSON file.")
+    args = parser.parse_args()
+    try:
+        run(args.image, args.azimuths, args.distances, args.output)
+    except NoGPSError as e:
+        print(e)
+        sys.exit(NO_GPS_EXIT_CODE)
 
 if __name__ == '__main__':
     main()
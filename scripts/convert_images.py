@@ -3,12 +3,89 @@ from PIL import Image, ImageDraw, ImageFont
 import math
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 
+try:
+    import cv2
+except ImportError:  # Sin OpenCV se muestrea por vecino más cercano con NumPy
+    cv2 = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420
+    _turbojpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):  # Sin libjpeg-turbo se codifica con PIL
+    _turbojpeg = None
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:  # Sin numba el muestreo sin OpenCV se hace con NumPy
+    HAS_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 import argparse
+from cube_faces import FACE_AXES
+
+FACE_NAMES = ["front", "right", "back", "left", "up", "down"]
+
+# Mapas de coordenadas compartidos entre instancias del proceso: solo dependen de
+# (ancho, alto, cube_size), que suele ser igual para todas las imágenes del lote
+_COORD_CACHE = {}  # (ancho, alto, cube_size) -> {face_index: (img_x, img_y)}
+
+@njit(cache=True, nogil=True)
+def _cube_to_equirect(face, a, b, width, height):
+    """Proyecta el punto (a, b) en [-1, 1] de una cara a coordenadas equirectangulares (img_x, img_y)"""
+    if face == 0:  # Frente (+Z)
+        x, y, z = a, b, 1.0
+    elif face == 1:  # Derecha (+X)
+        x, y, z = 1.0, b, -a
+    elif face == 2:  # Atrás (-Z)
+        x, y, z = -a, b, -1.0
+    elif face == 3:  # Izquierda (-X)
+        x, y, z = -1.0, b, a
+    elif face == 4:  # Arriba (+Y)
+        x, y, z = a, 1.0, -b
+    else:  # Abajo (-Y)
+        x, y, z = a, -1.0, b
+    
+    theta = math.atan2(y, math.sqrt(x*x + z*z))
+    phi = math.atan2(x, z)
+    
+    img_x = min(max((phi / math.pi + 1.0) * 0.5 * width, 0.0), width - 1.0)
+    img_y = min(max((0.5 - theta / math.pi) * height, 0.0), height - 1.0)
+    return img_x, img_y
+
+@njit(parallel=True, cache=True, nogil=True)
+def _remap_face(src, face, cube_size, out):
+    """Muestrea una cara del cubo en out (cube_size, cube_size, 3) sin arrays intermedios"""
+    height, width = src.shape[0], src.shape[1]
+    for j in prange(cube_size):
+        b = 1.0 - 2.0 * j / cube_size
+        for i in range(cube_size):
+            a = 2.0 * i / cube_size - 1.0
+            img_x, img_y = _cube_to_equirect(face, a, b, width, height)
+            ix = int(img_x)
+            iy = int(img_y)
+            out[j, i, 0] = src[iy, ix, 0]
+            out[j, i, 1] = src[iy, ix, 1]
+            out[j, i, 2] = src[iy, ix, 2]
+
+@njit(cache=True, nogil=True)
+def _project_points(points, face, cube_size, width, height):
+    """Proyecta en sitio puntos (N, 2) int32 (i, j) de una cara a píxeles equirectangulares"""
+    for k in range(points.shape[0]):
+        a = 2.0 * points[k, 0] / cube_size - 1.0
+        b = 1.0 - 2.0 * points[k, 1] / cube_size
+        img_x, img_y = _cube_to_equirect(face, a, b, width, height)
+        points[k, 0] = int(img_x)
+        points[k, 1] = int(img_y)
+
 
 class CubemapBBoxConverter:
-    def __init__(self, input_image_path, output_dir="cubemap_output", cube_size=None):
+    def __init__(self, input_image_path, output_dir="cubemap_output", cube_size=None, cache_dir=None):
         """
         Conversor de cubemap con soporte para bounding boxes
         
@@ -16,10 +93,12 @@ class CubemapBBoxConverter:
             input_image_path: Ruta de la imagen 360° equirectangular
             output_dir: Directorio donde guardar las caras del cubo
             cube_size: Tamaño de cada cara del cubo
+            cache_dir: Directorio donde persistir los mapas de coordenadas (None = sin caché en disco)
         """
         self.input_path = input_image_path
         self.output_dir = output_dir
-        self.image = None
+        self.image = None  # Imagen PIL (solo si no se decodificó con libjpeg-turbo)
+        self._src = None  # Array NumPy (H, W, 3) de la imagen
         self.width = 0
         self.height = 0
         self.cube_size = cube_size
@@ -27,16 +106,27 @@ class CubemapBBoxConverter:
         # Para almacenar detecciones de YOLO
         self.detections = {}  # face_index -> detections
         
+        # Mapas de coordenadas equirectangulares por cara
+        self._coord_cache = {}  # face_index -> (img_x, img_y)
+        self.cache_dir = cache_dir
+        
         os.makedirs(output_dir, exist_ok=True)
         
     def load_image(self):
         """Carga la imagen 360°"""
         try:
-            self.image = Image.open(self.input_path)
-            self.width, self.height = self.image.size
+            self._src = self._decode_jpeg()
+            if self._src is None:
+                self.image = Image.open(self.input_path).convert('RGB')
+                self._src = np.asarray(self.image)
+            self.height, self.width = self._src.shape[:2]
             
             if self.cube_size is None:
                 self.cube_size = self.width // 4
+            key = (self.width, self.height, self.cube_size)
+            if key not in _COORD_CACHE:
+                _COORD_CACHE.clear()  # Solo se mantiene la última resolución en memoria
+            self._coord_cache = _COORD_CACHE.setdefault(key, {})
                 
             print(f"Imagen cargada: {self.width}x{self.height}")
             print(f"Tamaño de cara del cubo: {self.cube_size}x{self.cube_size}")
@@ -46,34 +136,51 @@ class CubemapBBoxConverter:
             return False
         return True
     
-    def equirectangular_to_cubemap_coord(self, face, i, j):
-        """Convierte coordenadas del cubo a coordenadas equirectangulares"""
-        a = 2.0 * i / self.cube_size - 1.0
-        b = 1.0 - 2.0 * j / self.cube_size
-        
-        if face == 0:  # Frente (+Z)
-            x, y, z = a, b, 1.0
-        elif face == 1:  # Derecha (+X)
-            x, y, z = 1.0, b, -a
-        elif face == 2:  # Atrás (-Z)
-            x, y, z = -a, b, -1.0
-        elif face == 3:  # Izquierda (-X)
-            x, y, z = -1.0, b, a
-        elif face == 4:  # Arriba (+Y)
-            x, y, z = a, 1.0, -b
-        elif face == 5:  # Abajo (-Y)
-            x, y, z = a, -1.0, b
-        
-        theta = math.atan2(y, math.sqrt(x*x + z*z))
-        phi = math.atan2(x, z)
-        
-        img_x = (phi / math.pi + 1.0) * 0.5 * self.width
-        img_y = (0.5 - theta / math.pi) * self.height
-        
-        img_x = max(0, min(self.width - 1, img_x))
-        img_y = max(0, min(self.height - 1, img_y))
-        
-        return int(img_x), int(img_y)
+    def _decode_jpeg(self):
+        """
+        Decodifica la imagen directamente a un array RGB con libjpeg-turbo (sin pasar por PIL)
+        
+        Returns:
+            Array (alto, ancho, 3) uint8, o None si no es JPEG o no hay libjpeg-turbo
+        """
+        if _turbojpeg is None or not self.input_path.lower().endswith(('.jpg', '.jpeg')):
+            return None
+        try:
+            with open(self.input_path, 'rb') as f:
+                return _turbojpeg.decode(f.read(), pixel_format=TJPF_RGB)
+        except (OSError, ValueError):  # JPEG CMYK u otros casos no soportados: se usa PIL
+            return None
+    
+    def equirectangular_to_cubemap_coord_vec(self, face, i, j):
+        """
+        Proyecta puntos de una cara a coordenadas equirectangulares
+        (versión vectorizada de _cube_to_equirect)
+        
+        Args:
+            face: Índice de la cara (0-5) o array de índices con la forma de i, j
+            i, j: Arrays con coordenadas en la cara del cubo
+            
+        Returns:
+            img_x, img_y: Arrays float32 con coordenadas equirectangulares
+        """
+        a = 2.0 * np.asarray(i, dtype=np.float32) / self.cube_size - 1.0
+        b = 1.0 - 2.0 * np.asarray(j, dtype=np.float32) / self.cube_size
+        
+        # q = R_cara · [a, b, 1], sin ramas por cara
+        p_hat = np.stack(np.broadcast_arrays(a, b, np.float32(1.0)), axis=-1)
+        q = np.einsum('...ij,...j->...i', FACE_AXES[face], p_hat)
+        x, y, z = q[..., 0], q[..., 1], q[..., 2]
+        
+        theta = np.arctan2(y, np.sqrt(x*x + z*z))
+        phi = np.arctan2(x, z)
+        
+        img_x = (phi / np.pi + 1.0) * 0.5 * self.width
+        img_y = (0.5 - theta / np.pi) * self.height
+        
+        img_x = np.clip(img_x, 0, self.width - 1)
+        img_y = np.clip(img_y, 0, self.height - 1)
+        
+        return img_x, img_y
     
     def cubemap_to_equirectangular_coord(self, face, cube_x, cube_y):
         """
@@ -86,45 +193,138 @@ class CubemapBBoxConverter:
         Returns:
             eq_x, eq_y: Coordenadas en imagen equirectangular
         """
-        return self.equirectangular_to_cubemap_coord(face, cube_x, cube_y)
+        map_x, map_y = self.face_coords(face)
+        x = min(max(int(cube_x), 0), self.cube_size - 1)
+        y = min(max(int(cube_y), 0), self.cube_size - 1)
+        return int(map_x[y, x]), int(map_y[y, x])
+    
+    def face_coords(self, face_index):
+        """
+        Devuelve los mapas de coordenadas equirectangulares de una cara,
+        calculándolos solo la primera vez
+        
+        Returns:
+            img_x, img_y: Arrays (cube_size, cube_size) indexados como [j, i];
+                float32 para cv2.remap o índices enteros para el muestreo con NumPy
+        """
+        if face_index in self._coord_cache:
+            return self._coord_cache[face_index]
+        
+        # Sin OpenCV los mapas solo se usan como índices: int16 basta hasta 32767 px
+        if cv2 is not None:
+            dtype = np.dtype(np.float32)
+        elif max(self.width, self.height) <= np.iinfo(np.int16).max:
+            dtype = np.dtype(np.int16)
+        else:
+            dtype = np.dtype(np.int32)
+        
+        # Los mapas solo dependen de (ancho, alto, cube_size): se reutilizan entre imágenes
+        cache_path = None
+        if self.cache_dir:
+            cache_path = os.path.join(self.cache_dir,
+                                      f"{self.width}x{self.height}_cs{self.cube_size}_f{face_index}_{dtype.name}.npy")
+            if os.path.isfile(cache_path):
+                maps = np.load(cache_path, mmap_mode='r')
+                self._coord_cache[face_index] = (maps[0], maps[1])
+                return self._coord_cache[face_index]
+        
+        i, j = np.meshgrid(np.arange(self.cube_size), np.arange(self.cube_size))
+        coords = tuple(c.astype(dtype) for c in self.equirectangular_to_cubemap_coord_vec(face_index, i, j))
+        self._coord_cache[face_index] = coords
+        
+        if cache_path:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.stack(coords))
+            os.replace(tmp_path, cache_path)
+        return coords
     
     def extract_face(self, face_index):
         """Extrae una cara específica del cubo"""
-        face_image = Image.new('RGB', (self.cube_size, self.cube_size))
-        face_pixels = face_image.load()
-        source_pixels = self.image.load()
+        return Image.fromarray(self.extract_face_array(face_index), 'RGB')
+    
+    def extract_face_array(self, face_index):
+        """Extrae una cara específica del cubo como array (cube_size, cube_size, 3) RGB"""
+        if cv2 is None and HAS_NUMBA:
+            # Kernel compilado: calcula y muestrea en un solo paso, sin mapas en memoria
+            face_arr = np.empty((self.cube_size, self.cube_size, 3), dtype=np.uint8)
+            _remap_face(self._src, face_index, self.cube_size, face_arr)
+            return face_arr
         
-        for j in range(self.cube_size):
-            for i in range(self.cube_size):
-                src_x, src_y = self.equirectangular_to_cubemap_coord(face_index, i, j)
-                face_pixels[i, j] = source_pixels[src_x, src_y]
+        map_x, map_y = self.face_coords(face_index)
         
-        return face_image
+        if cv2 is None:
+            face_arr = self._src[map_y, map_x]
+        else:
+            # Interpolación bilineal sobre centros de píxel; BORDER_WRAP une
+            # horizontalmente el borde de longitud ±180°
+            face_arr = cv2.remap(self._src, map_x - 0.5,
+                                 np.clip(map_y - 0.5, 0, self.height - 1),
+                                 interpolation=cv2.INTER_LINEAR,
+                                 borderMode=cv2.BORDER_WRAP)
+        return face_arr
+    
+    def save_face(self, face_index, face_arr):
+        """Codifica una cara (array RGB) como JPEG en output_dir; devuelve su ruta"""
+        filename = f"{FACE_NAMES[face_index]}.jpg"
+        filepath = os.path.join(self.output_dir, filename)
+        if _turbojpeg is not None:
+            with open(filepath, 'wb') as f:
+                f.write(_turbojpeg.encode(face_arr, quality=95, pixel_format=TJPF_RGB,
+                                          jpeg_subsample=TJSAMP_420))
+        else:
+            Image.fromarray(face_arr, 'RGB').save(filepath, quality=95)
+        
+        print(f"Guardado: {filepath}")
+        return filepath
+    
+    def _extract_and_save(self, face_index):
+        """Extrae una cara y la guarda en disco; devuelve su ruta"""
+        print(f"Procesando cara {face_index + 1}/6: {FACE_NAMES[face_index]}")
+        return self.save_face(face_index, self.extract_face_array(face_index))
     
     def convert_to_cubemap(self):
         """Convierte la imagen 360° a las 6 caras del cubemap"""
         if not self.load_image():
             return False
         
-        face_names = ["front", "right", "back", "left", "up", "down"]
-        face_paths = []
-        
         print("Iniciando conversión a cubemap...")
         
-        for face_index in range(6):
-            print(f"Procesando cara {face_index + 1}/6: {face_names[face_index]}")
-            
-            face_image = self.extract_face(face_index)
-            filename = f"{face_names[face_index]}.jpg"
-            filepath = os.path.join(self.output_dir, filename)
-            face_image.save(filepath, quality=95)
-            face_paths.append(filepath)
-            
-            print(f"Guardado: {filepath}")
+        # El muestreo (NumPy/OpenCV) y la codificación JPEG liberan el GIL:
+        # las seis caras se procesan en paralelo
+        with ThreadPoolExecutor(max_workers=min(6, os.cpu_count() or 1)) as executor:
+            face_paths = list(executor.map(self._extract_and_save, range(6)))
         
         print("¡Conversión completada!")
         return face_paths
     
+    def extract_faces(self, save=False):
+        """
+        Extrae las 6 caras en memoria, para pasarlas directamente a YOLO/UniDepth
+        
+        Args:
+            save: Guardar además cada cara como JPEG en output_dir
+            
+        Returns:
+            Diccionario {nombre_cara: array (cube_size, cube_size, 3) RGB}, o None si falla la carga
+        """
+        if not self.load_image():
+            return None
+        
+        def extract(face_index):
+            print(f"Procesando cara {face_index + 1}/6: {FACE_NAMES[face_index]}")
+            face_arr = self.extract_face_array(face_index)
+            if save:
+                self.save_face(face_index, face_arr)
+            return face_arr
+        
+        with ThreadPoolExecutor(max_workers=min(6, os.cpu_count() or 1)) as executor:
+            faces = dict(zip(FACE_NAMES, executor.map(extract, range(6))))
+        
+        print("¡Conversión completada!")
+        return faces
+    
     def transform_bbox_to_equirectangular(self, face_index, bbox):
         """
         Transforma un bounding box de una cara del cubo a coordenadas equirectangulares
@@ -134,34 +334,38 @@ class CubemapBBoxConverter:
             bbox: [x1, y1, x2, y2] en coordenadas de la cara del cubo
             
         Returns:
-            Lista de puntos [(x, y)] que forman el contorno en coordenadas equirectangulares
+            Array (N, 2) int32 con los puntos (x, y) que forman el contorno en coordenadas equirectangulares
         """
         x1, y1, x2, y2 = bbox
+        step_x = max(1, int((x2-x1)/20))
+        step_y = max(1, int((y2-y1)/20))
         
-        # Crear puntos del perímetro del bounding box
-        perimeter_points = []
-        
-        # Borde superior (y1)
-        for x in range(int(x1), int(x2) + 1, max(1, int((x2-x1)/20))):
-            eq_x, eq_y = self.cubemap_to_equirectangular_coord(face_index, x, y1)
-            perimeter_points.append((eq_x, eq_y))
-        
-        # Borde derecho (x2)
-        for y in range(int(y1), int(y2) + 1, max(1, int((y2-y1)/20))):
-            eq_x, eq_y = self.cubemap_to_equirectangular_coord(face_index, x2, y)
-            perimeter_points.append((eq_x, eq_y))
-        
-        # Borde inferior (y2)
-        for x in range(int(x2), int(x1) - 1, -max(1, int((x2-x1)/20))):
-            eq_x, eq_y = self.cubemap_to_equirectangular_coord(face_index, x, y2)
-            perimeter_points.append((eq_x, eq_y))
-        
-        # Borde izquierdo (x1)
-        for y in range(int(y2), int(y1) - 1, -max(1, int((y2-y1)/20))):
-            eq_x, eq_y = self.cubemap_to_equirectangular_coord(face_index, x1, y)
-            perimeter_points.append((eq_x, eq_y))
+        # Puntos del perímetro: borde superior, derecho, inferior e izquierdo,
+        # escritos por tramos en un único buffer (N, 2)
+        top_x = np.arange(int(x1), int(x2) + 1, step_x)
+        right_y = np.arange(int(y1), int(y2) + 1, step_y)
+        bottom_x = np.arange(int(x2), int(x1) - 1, -step_x)
+        left_y = np.arange(int(y2), int(y1) - 1, -step_y)
+        n_top, n_right, n_bottom = len(top_x), len(right_y), len(bottom_x)
+        n_edges = np.cumsum([n_top, n_right, n_bottom, len(left_y)])
+        points = np.empty((n_edges[-1], 2), dtype=np.int32)
+        points[:n_edges[0], 0], points[:n_edges[0], 1] = top_x, int(y1)
+        points[n_edges[0]:n_edges[1], 0], points[n_edges[0]:n_edges[1], 1] = int(x2), right_y
+        points[n_edges[1]:n_edges[2], 0], points[n_edges[1]:n_edges[2], 1] = bottom_x, int(y2)
+        points[n_edges[2]:, 0], points[n_edges[2]:, 1] = int(x1), left_y
         
-        return perimeter_points
+        np.clip(points, 0, self.cube_size - 1, out=points)
+        if HAS_NUMBA and face_index not in self._coord_cache:
+            # Sin mapas calculados (muestreo con el kernel numba) basta proyectar el perímetro
+            _project_points(points, face_index, self.cube_size, self.width, self.height)
+            return points
+        map_x, map_y = self.face_coords(face_index)
+        xs, ys = points[:, 0], points[:, 1]
+        eq_xs = map_x[ys, xs]
+        eq_ys = map_y[ys, xs]
+        points[:, 0] = eq_xs
+        points[:, 1] = eq_ys
+        return points
 
 
 def main():
@@ -172,6 +376,8 @@ def main():
     parser.add_argument("-i", "--image", required=True, help="Ruta a imagen equirectangular 360°")
     parser.add_argument("-o", "--output-dir", default="cubemap_output", help="Directorio de salida")
     parser.add_argument("-c", "--cube-size", type=int, default=None, help="Tamaño de cada cara del cubemap")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Directorio para reutilizar los mapas de coordenadas entre ejecuciones")
     args = parser.parse_args()
     input_image = args.image
     output_directory = args.output_dir
@@ -180,7 +386,7 @@ def main():
     print("=== Pipeline: 360° -> Cubemap ===\n")
             
     # Crear conversor
-    converter = CubemapBBoxConverter(input_image, output_directory, cube_size)
+    converter = CubemapBBoxConverter(input_image, output_directory, cube_size, args.cache_dir)
             
     # Paso 1: Convertir a cubemap
     print("1. Convertiendo imagen 360° a cubemap...")
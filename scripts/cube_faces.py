@@ -0,0 +1,18 @@
+"""
+cube_faces.py
+Convención de caras del cubemap compartida por la conversión (convert_images.py)
+y el cálculo de azimuths (calculate_azimuths.py), sin dependencias aparte de NumPy.
+"""
+import numpy as np
+
+# Rotación (6, 3, 3) de cada cara: filas (x, y, z) como combinación lineal de (a, b, 1):
+# 0=frente(+Z), 1=derecha(+X), 2=atrás(-Z), 3=izquierda(-X), 4=arriba(+Y), 5=abajo(-Y)
+# Las rutas escalares (_cube_to_equirect, compute_direction) la desarrollan como ramas
+FACE_AXES = np.array([
+    [[1, 0, 0], [0, 1, 0], [0, 0, 1]],
+    [[0, 0, 1], [0, 1, 0], [-1, 0, 0]],
+    [[-1, 0, 0], [0, 1, 0], [0, 0, -1]],
+    [[0, 0, -1], [0, 1, 0], [1, 0, 0]],
+    [[1, 0, 0], [0, 0, 1], [0, -1, 0]],
+    [[1, 0, 0], [0, 0, -1], [0, 1, 0]],
+], dtype=np.float32)
@@ -5,6 +5,7 @@ Estimate absolute distances (m) per detection using UniDepth.
 """
 import os
 import json
+import math
 import argparse
 import numpy as np
 import torch
@@ -14,6 +15,8 @@ from torchvision import transforms
 # Names for cubemap faces
 FACE_NAMES = ["front", "right", "back", "left", "up", "down"]
 
+DEFAULT_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
 # Default transform: resize to model input and normalize imagenet
 DEFAULT_SHAPE = (480, 640)  # height, width from UniDepth config
 TRANSFORM = transforms.Compose([
@@ -29,55 +32,88 @@ def load_unidepth(version, backbone, device):
         version=version, backbone=backbone, pretrained=True
     )
     model.to(device).eval()
+    if str(device).startswith("cuda"):
+        # NHWC layout lets cuDNN pick its faster tensor-core conv kernels
+        model.to(memory_format=torch.channels_last)
     return model
 
 
-def estimate_depth_face(model, device, img_path):
-    img = cv2.imread(img_path)
-    if img is None:
-        raise FileNotFoundError(f"Cannot load image {img_path}")
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    inp = TRANSFORM(img_rgb).unsqueeze(0).to(device)
-    with torch.no_grad():
+def estimate_depth_arrays(model, device, imgs_rgb):
+    """
+    Run UniDepth once on a batch with all the given RGB face arrays.
+
+    Returns one (depth, scale_x, scale_y) per face: the depth map at the model's
+    output resolution and the factors that map face pixel coords onto it.
+    """
+    batch = torch.stack([TRANSFORM(img) for img in imgs_rgb])
+    on_gpu = str(device).startswith("cuda")
+    if on_gpu:
+        batch = batch.pin_memory().to(device, non_blocking=True).contiguous(memory_format=torch.channels_last)
+    else:
+        batch = batch.to(device)
+    # FP16 autocast on GPU (tensor cores); weights stay FP32 so UniDepth's camera head keeps its precision
+    with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=on_gpu):
         # use UniDepth's infer to get absolute depth in meters
-        out = model.infer(inp)
+        out = model.infer(batch)
     # out["depth"] tensor shape [B,1,H',W']
-    depth_tensor = out["depth"]
-    depth = depth_tensor.squeeze().cpu().numpy()
-    # resize back to original resolution
-    depth = cv2.resize(depth, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_CUBIC)
-    return depth
+    depth_batch = out["depth"].squeeze(1).float().cpu().numpy()
+    # keep the native resolution; boxes are rescaled instead of upsampling the whole map
+    return [(depth, depth.shape[1] / img.shape[1], depth.shape[0] / img.shape[0])
+            for depth, img in zip(depth_batch, imgs_rgb)]
 
 
-def main():
-    p = argparse.ArgumentParser(description="Estimate distances with UniDepth (absolute in meters)")
-    p.add_argument("-d","--detections", default="cubemap_output/detections.json")
-    p.add_argument("-f","--faces_dir", default="cubemap_output")
-    p.add_argument("-o","--output", default="cubemap_output/distances_unidepth.json")
-    p.add_argument("--version", choices=["v1","v2","v2old"], default="v2")
-    p.add_argument("--backbone", default="vitl14")
-    p.add_argument("--device", default=("cuda" if torch.cuda.is_available() else "cpu"))
-    args = p.parse_args()
+def estimate_depth_faces(model, device, img_paths):
+    """Read the face images and run them through UniDepth as a single batch."""
+    imgs = []
+    for img_path in img_paths:
+        img = cv2.imread(img_path)
+        if img is None:
+            raise FileNotFoundError(f"Cannot load image {img_path}")
+        imgs.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    return estimate_depth_arrays(model, device, imgs)
 
-    if not os.path.exists(args.detections):
-        print(f"Detections not found: {args.detections}")
-        return
-    dets = json.load(open(args.detections))
 
-    device = args.device
-    model = load_unidepth(args.version, args.backbone, device)
+def estimate_depth_face(model, device, img_path):
+    return estimate_depth_faces(model, device, [img_path])[0]
 
-    results = {}
-    for face_str, data in dets.items():
+
+def run(model, device, detections_path, faces_dir, output_path, faces=None):
+    """
+    Estimate per-detection distances with an already loaded UniDepth model.
+
+    faces ({face_name: RGB array}) skips reading the face images from faces_dir.
+    """
+    with open(detections_path) as f:
+        dets = json.load(f)
+
+    names = []
+    for face_str in dets:
         face = int(face_str)
-        name = FACE_NAMES[face] if face < len(FACE_NAMES) else face_str
-        img_path = os.path.join(args.faces_dir, f"{name}.jpg")
-        depth_map = estimate_depth_face(model, device, img_path)
+        names.append(FACE_NAMES[face] if face < len(FACE_NAMES) else face_str)
+    # Single forward pass for all faces with detections
+    with_boxes = [name for name, data in zip(names, dets.values()) if data.get('boxes')]
+    depth_maps = {}
+    if with_boxes and faces is not None:
+        depth_maps = dict(zip(with_boxes, estimate_depth_arrays(
+            model, device, [faces[name] for name in with_boxes])))
+    elif with_boxes:
+        img_paths = [os.path.join(faces_dir, f"{name}.jpg") for name in with_boxes]
+        depth_maps = dict(zip(with_boxes, estimate_depth_faces(model, device, img_paths)))
+
+    results = {}
+    for name, data in zip(names, dets.values()):
+        depth_map, scale_x, scale_y = depth_maps.get(name, (None, 1.0, 1.0))
         face_out = []
         for idx, bbox in enumerate(data.get('boxes', [])):
             x1,y1,x2,y2 = map(int, bbox)
-            region = depth_map[y1:y2, x1:x2]
-            dist = float(np.median(region)) if region.size>0 else None
+            dist = None
+            if x2 > x1 and y2 > y1:
+                # bbox in depth-map pixels, at least one pixel wide/high
+                x1d, y1d = max(0, int(x1 * scale_x)), max(0, int(y1 * scale_y))
+                x2d = max(x1d + 1, math.ceil(x2 * scale_x))
+                y2d = max(y1d + 1, math.ceil(y2 * scale_y))
+                region = depth_map[y1d:y2d, x1d:x2d]
+                dist = float(np.median(region)) if region.size>0 else None
             face_out.append({
                 'bbox_index': idx,
                 'class_id': int(data.get('classes', [])[idx]) if idx < len(data.get('classes', [])) else None,
@@ -86,10 +122,29 @@ def main():
             })
         results[name] = face_out
 
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
-    with open(args.output,'w') as f:
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path,'w') as f:
         json.dump(results, f, indent=2)
-    print(f"Saved distances (m) to {args.output}")
+    print(f"Saved distances (m) to {output_path}")
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Estimate distances with UniDepth (absolute in meters)")
+    p.add_argument("-d","--detections", default="cubemap_output/detections.json")
+    p.add_argument("-f","--faces_dir", default="cubemap_output")
+    p.add_argument("-o","--output", default="cubemap_output/distances_unidepth.json")
+    p.add_argument("--version", choices=["v1","v2","v2old"], default="v2")
+    p.add_argument("--backbone", default="vitl14")
+    p.add_argument("--device", default=DEFAULT_DEVICE)
+    args = p.parse_args()
+
+    if not os.path.exists(args.detections):
+        print(f"Detections not found: {args.detections}")
+        return
+
+    model = load_unidepth(args.version, args.backbone, args.device)
+    run(model, args.device, args.detections, args.faces_dir, args.output)
 
 if __name__=='__main__':
     main()
@@ -5,26 +5,148 @@ Soporta formatos JPEG, TIFF y otros formatos con metadatos EXIF
 """
 
 import os
+import re
 import sys
+import struct
+import hashlib
 from PIL import Image
 from PIL.ExifTags import TAGS, GPSTAGS
 import json
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from collections import ChainMap
+
+# Etiquetas relacionadas con la altura de la cámara, en el orden en que se informan
+BAROMETRIC_TAGS = ('BarometricPressure', 'Pressure', 'RelativeAltitude')
+DRONE_TAGS = (
+    'DroneAltitude', 'FlightAltitude', 'RelativeAltitude',
+    'AbsoluteAltitude', 'TakeOffAltitude', 'HomePointAltitude'
+)
+XMP_HEIGHT_TAGS = (
+    'CameraElevation', 'ShootingHeight', 'AltitudeAboveGround',
+    'HeightAboveTerrain', 'FlightHeight'
+)
+MOTION_TAGS = ('Accelerometer', 'Gyroscope', 'Orientation', 'CameraTilt')
+ALL_HEIGHT_TAGS = frozenset(BAROMETRIC_TAGS + DRONE_TAGS + XMP_HEIGHT_TAGS + MOTION_TAGS)
+
+# Marcas (campo Make) por tipo de dispositivo, para estimar la altura típica
+DRONE_RE = re.compile(r'DJI|PARROT|AUTEL|SKYDIO|YUNEEC')
+ACTION_CAMERA_RE = re.compile(r'GOPRO|INSTA360')
+SMARTPHONE_RE = re.compile(r'APPLE|SAMSUNG|GOOGLE|HUAWEI')
+# Estimación de altura del resumen por tipo de dispositivo (device_info['type'])
+DEVICE_HEIGHT_HINTS = {
+    'drone': "Probablemente tomada entre 20-120 metros (drone)",
+    'action_camera': "Probablemente tomada entre 1.5-4 metros (cámara de acción)",
+    'smartphone': "Probablemente tomada entre 1.2-2 metros (smartphone)",
+}
+
+# Extensiones que se procesan al pasar un directorio
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.tif', '.tiff', '.png')
+
+try:
+    import orjson
+except ImportError:  # Sin orjson se usa el codificador de la librería estándar
+    orjson = None
+
+# Identificadores numéricos de las etiquetas GPS que se leen directamente
+GPS_TAG_IDS = {name: tag_id for tag_id, name in GPSTAGS.items()}
+GPS_ALTITUDE_ID = GPS_TAG_IDS['GPSAltitude']
+GPS_ALTITUDE_REF_ID = GPS_TAG_IDS['GPSAltitudeRef']
 
 def dms_to_decimal(dms, ref):
     """
     Convierte coordenadas DMS (Degrees, Minutes, Seconds) a decimal
     """
-    degrees = dms[0]
-    minutes = dms[1] / 60.0
-    seconds = dms[2] / 3600.0
+    decimal = dms[0] + dms[1] / 60.0 + dms[2] / 3600.0
+    return -decimal if ref in ('S', 'W') else decimal
+
+def _read_tiff_gps(tiff):
+    """
+    Lee latitud y longitud del IFD GPS de un bloque TIFF/EXIF (bytes que empiezan
+    por la cabecera II/MM); devuelve (lat, lon) o None
+    """
+    order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if order is None:
+        return None
+    u16, u32 = struct.Struct(order + 'H'), struct.Struct(order + 'I')
+    
+    def entries(offset):
+        # Entradas de 12 bytes del IFD: tag, tipo, número de valores y valor/offset
+        count = u16.unpack_from(tiff, offset)[0]
+        for pos in range(offset + 2, offset + 2 + 12 * count, 12):
+            yield struct.unpack_from(order + 'HHI', tiff, pos) + (pos + 8,)
     
-    decimal = degrees + minutes + seconds
+    gps_offset = None
+    for tag, _, _, value_pos in entries(u32.unpack_from(tiff, 4)[0]):
+        if tag == 0x8825:
+            gps_offset = u32.unpack_from(tiff, value_pos)[0]
+            break
+    if gps_offset is None:
+        return None
     
-    if ref in ['S', 'W']:
-        decimal = -decimal
+    gps = {}
+    for tag, typ, count, value_pos in entries(gps_offset):
+        if tag in (1, 3) and typ == 2:
+            # Referencia N/S/E/W: ASCII de 2 bytes dentro de la propia entrada
+            gps[tag] = tiff[value_pos:value_pos + 1].decode('ascii', 'replace')
+        elif tag in (2, 4) and typ in (5, 10) and count == 3:
+            # Grados, minutos y segundos: 3 racionales (numerador, denominador) en el offset
+            fmt = order + ('6I' if typ == 5 else '6i')
+            raw = struct.unpack_from(fmt, tiff, u32.unpack_from(tiff, value_pos)[0])
+            gps[tag] = [num / den if den else 0.0 for num, den in zip(raw[::2], raw[1::2])]
+    if 2 not in gps or 4 not in gps:
+        return None
+    return dms_to_decimal(gps[2], gps.get(1, 'N')), dms_to_decimal(gps[4], gps.get(3, 'E'))
+
+def fast_gps_only(image_path):
+    """
+    Devuelve (latitud, longitud) de una imagen o None si no tiene GPS, sin decodificar
+    la imagen ni recorrer todo el EXIF: en JPEG solo se leen las cabeceras de los
+    segmentos hasta el APP1 Exif y de este solo los IFD0 y GPS
+    """
+    with open(image_path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            tiff = None
+        else:
+            while True:
+                header = f.read(4)
+                # Fin de las cabeceras (SOS/EOI) o archivo truncado: no hay EXIF
+                if len(header) < 4 or header[0] != 0xFF or header[1] in (0xDA, 0xD9):
+                    return None
+                length = struct.unpack('>H', header[2:])[0]
+                if header[1] == 0xE1:
+                    segment = f.read(length - 2)
+                    if segment[:6] == b'Exif\x00\x00':
+                        tiff = segment[6:]
+                        break
+                else:
+                    f.seek(length - 2, os.SEEK_CUR)
     
-    return decimal
+    if tiff is None:
+        # Otros formatos (TIFF, PNG...): lectura normal con PIL
+        with Image.open(image_path) as img:
+            gps_data = extract_gps_data({'GPSInfo': read_exif(img).get(0x8825, {})})
+        if 'DecimalLatitude' in gps_data and 'DecimalLongitude' in gps_data:
+            return gps_data['DecimalLatitude'], gps_data['DecimalLongitude']
+        return None
+    try:
+        return _read_tiff_gps(tiff)
+    except struct.error:  # EXIF truncado o con offsets fuera del segmento
+        return None
+
+def gps_altitude(gps_info):
+    """
+    Devuelve la altitud GPS en metros (negativa bajo el nivel del mar) leyendo
+    directamente las etiquetas numéricas de GPSInfo, o None si no está
+    """
+    altitude = gps_info.get(GPS_ALTITUDE_ID)
+    if altitude is None:
+        return None
+    altitude = float(altitude)
+    if gps_info.get(GPS_ALTITUDE_REF_ID, 0) == 1:  # Por debajo del nivel del mar
+        altitude = -altitude
+    return altitude
 
 def extract_gps_data(exif_data):
     """
@@ -35,10 +157,9 @@ def extract_gps_data(exif_data):
     if 'GPSInfo' in exif_data:
         gps_info = exif_data['GPSInfo']
         
-        # Procesar cada tag GPS
-        for key in gps_info.keys():
-            name = GPSTAGS.get(key, key)
-            gps_data[name] = gps_info[key]
+        # Procesar cada tag GPS (búsqueda de nombres ligada en local)
+        tag_name = GPSTAGS.get
+        gps_data = {tag_name(key, key): value for key, value in gps_info.items()}
         
         # Extraer coordenadas si están disponibles
         if 'GPSLatitude' in gps_data and 'GPSLatitudeRef' in gps_data:
@@ -50,11 +171,8 @@ def extract_gps_data(exif_data):
             gps_data['DecimalLongitude'] = lon
             
         # Extraer altitud GPS si está disponible
-        if 'GPSAltitude' in gps_data:
-            altitude = float(gps_data['GPSAltitude'])
-            altitude_ref = gps_data.get('GPSAltitudeRef', 0)
-            if altitude_ref == 1:  # Por debajo del nivel del mar
-                altitude = -altitude
+        altitude = gps_altitude(gps_info)
+        if altitude is not None:
             gps_data['DecimalAltitude'] = altitude
             gps_data['AltitudeSource'] = 'GPS'
         
@@ -82,10 +200,37 @@ def extract_gps_data(exif_data):
     
     return gps_data
 
-def extract_camera_height_data(exif_data):
+def read_xmp(img):
+    """
+    Lee las propiedades XMP (rdf:Description) de una imagen ya abierta como
+    {nombre_sin_espacio_de_nombres: valor}; {} si no hay XMP o falta defusedxml
+    """
+    if not hasattr(img, 'getxmp'):
+        return {}
+    try:
+        node = img.getxmp()
+    except Exception:
+        return {}
+    for key in ('xmpmeta', 'RDF', 'Description'):
+        node = node.get(key, {}) if isinstance(node, dict) else {}
+    descriptions = node if isinstance(node, list) else [node]
+    
+    xmp_data = {}
+    for description in descriptions:
+        if isinstance(description, dict):
+            for name, value in description.items():
+                if isinstance(value, str):
+                    xmp_data.setdefault(name, value)
+    return xmp_data
+
+def extract_camera_height_data(exif_data, xmp_data=None):
     """
     Extrae información relacionada con la altura de la cámara desde diferentes fuentes
+    (EXIF y, si se pasan, propiedades XMP como drone-dji:RelativeAltitude)
     """
+    if xmp_data:
+        # Las etiquetas EXIF tienen prioridad sobre las XMP del mismo nombre
+        exif_data = ChainMap(exif_data, xmp_data)
     height_data = {
         'sources_found': [],
         'height_estimates': {},
@@ -95,17 +240,8 @@ def extract_camera_height_data(exif_data):
     
     # 1. Altitud GPS (altura sobre el nivel del mar)
     if 'GPSInfo' in exif_data:
-        gps_info = exif_data['GPSInfo']
-        gps_tags = {}
-        for key in gps_info.keys():
-            name = GPSTAGS.get(key, key)
-            gps_tags[name] = gps_info[key]
-            
-        if 'GPSAltitude' in gps_tags:
-            altitude = float(gps_tags['GPSAltitude'])
-            altitude_ref = gps_tags.get('GPSAltitudeRef', 0)
-            if altitude_ref == 1:
-                altitude = -altitude
+        altitude = gps_altitude(exif_data['GPSInfo'])
+        if altitude is not None:
             height_data['height_estimates']['gps_altitude'] = {
                 'value': altitude,
                 'unit': 'meters',
@@ -114,70 +250,61 @@ def extract_camera_height_data(exif_data):
             }
             height_data['sources_found'].append('GPS Altitude')
     
-    # 2. Datos de sensores barométricos (algunos smartphones y drones)
-    barometric_tags = ['BarometricPressure', 'Pressure', 'RelativeAltitude']
-    for tag in barometric_tags:
-        if tag in exif_data:
-            height_data['sensor_data']['barometric'] = {
-                'value': exif_data[tag],
-                'tag': tag,
-                'description': 'Datos de presión barométrica'
-            }
-            height_data['sources_found'].append('Barometric Sensor')
-    
-    # 3. Metadatos específicos de drones (DJI, etc.)
-    drone_tags = [
-        'DroneAltitude', 'FlightAltitude', 'RelativeAltitude', 
-        'AbsoluteAltitude', 'TakeOffAltitude', 'HomePointAltitude'
-    ]
-    for tag in drone_tags:
-        if tag in exif_data:
-            height_data['flight_data'][tag.lower()] = {
-                'value': exif_data[tag],
-                'description': f'Altura del drone: {tag}'
-            }
-            height_data['sources_found'].append(f'Drone Data ({tag})')
-    
-    # 4. Metadatos XMP (Adobe, DJI y otros fabricantes)
-    xmp_height_indicators = [
-        'CameraElevation', 'ShootingHeight', 'AltitudeAboveGround',
-        'HeightAboveTerrain', 'FlightHeight'
-    ]
-    for tag in xmp_height_indicators:
-        if tag in exif_data:
-            height_data['height_estimates'][tag.lower()] = {
-                'value': exif_data[tag],
-                'source': 'XMP Metadata',
-                'description': f'Altura de cámara: {tag}'
-            }
-            height_data['sources_found'].append(f'XMP ({tag})')
-    
-    # 5. Datos de acelerómetro/giroscopio (orientación que puede indicar altura relativa)
-    motion_tags = ['Accelerometer', 'Gyroscope', 'Orientation', 'CameraTilt']
-    for tag in motion_tags:
-        if tag in exif_data:
-            height_data['sensor_data']['motion'] = height_data['sensor_data'].get('motion', {})
-            height_data['sensor_data']['motion'][tag.lower()] = exif_data[tag]
+    # 2-5. Etiquetas de sensores, drones y XMP: la mayoría de imágenes no tiene ninguna
+    if not ALL_HEIGHT_TAGS.isdisjoint(exif_data):
+        # 2. Datos de sensores barométricos (algunos smartphones y drones)
+        for tag in BAROMETRIC_TAGS:
+            if tag in exif_data:
+                height_data['sensor_data']['barometric'] = {
+                    'value': exif_data[tag],
+                    'tag': tag,
+                    'description': 'Datos de presión barométrica'
+                }
+                height_data['sources_found'].append('Barometric Sensor')
+        
+        # 3. Metadatos específicos de drones (DJI, etc.)
+        for tag in DRONE_TAGS:
+            if tag in exif_data:
+                height_data['flight_data'][tag.lower()] = {
+                    'value': exif_data[tag],
+                    'description': f'Altura del drone: {tag}'
+                }
+                height_data['sources_found'].append(f'Drone Data ({tag})')
+        
+        # 4. Metadatos XMP (Adobe, DJI y otros fabricantes)
+        for tag in XMP_HEIGHT_TAGS:
+            if tag in exif_data:
+                height_data['height_estimates'][tag.lower()] = {
+                    'value': exif_data[tag],
+                    'source': 'XMP Metadata',
+                    'description': f'Altura de cámara: {tag}'
+                }
+                height_data['sources_found'].append(f'XMP ({tag})')
+        
+        # 5. Datos de acelerómetro/giroscopio (orientación que puede indicar altura relativa)
+        for tag in MOTION_TAGS:
+            if tag in exif_data:
+                height_data['sensor_data']['motion'] = height_data['sensor_data'].get('motion', {})
+                height_data['sensor_data']['motion'][tag.lower()] = exif_data[tag]
     
     # 6. Detectar tipo de dispositivo para estimar altura típica
     device_info = {}
-    if 'Make' in exif_data and 'Model' in exif_data:
+    if 'Make' in exif_data:
         make = exif_data['Make'].upper()
-        model = exif_data['Model'].upper()
+        model = exif_data.get('Model', '').upper()
         
         # Detectar drones
-        drone_brands = ['DJI', 'PARROT', 'AUTEL', 'SKYDIO', 'YUNEEC']
-        if any(brand in make for brand in drone_brands):
+        if DRONE_RE.search(make):
             device_info['type'] = 'drone'
             device_info['typical_height_range'] = '20-120 meters'
             
         # Detectar cámaras de acción en postes/palos
-        elif 'GOPRO' in make or 'INSTA360' in make or 'RICOH THETA' in model:
+        elif ACTION_CAMERA_RE.search(make) or 'RICOH THETA' in model:
             device_info['type'] = 'action_camera'
             device_info['typical_height_range'] = '1.5-4 meters'
             
         # Detectar smartphones
-        elif any(brand in make for brand in ['APPLE', 'SAMSUNG', 'GOOGLE', 'HUAWEI']):
+        elif SMARTPHONE_RE.search(make):
             device_info['type'] = 'smartphone'
             device_info['typical_height_range'] = '1.2-2 meters'
             
@@ -185,50 +312,105 @@ def extract_camera_height_data(exif_data):
     
     return height_data
 
-def extract_360_metadata(image_path):
+def decode_exif_bytes(value):
+    """
+    Texto de un valor EXIF en bytes: UTF-8 si es posible, si no su representación
+    """
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return str(value)
+
+def read_exif(img):
+    """
+    Lee los metadatos EXIF de una imagen ya abierta (IFD0, Exif y GPSInfo)
+    sin decodificar los píxeles
+    """
+    exif = img.getexif()
+    if not exif:
+        return {}
+    exif_data = dict(exif)
+    exif_data.update(exif.get_ifd(0x8769))
+    # En IFD0 0x8825 es el offset del IFD GPS: se sustituye siempre por su contenido (aunque esté vacío)
+    if 0x8825 in exif:
+        exif_data[0x8825] = dict(exif.get_ifd(0x8825))
+    return exif_data
+
+def extract_360_metadata(image_path, img=None, exif=None, xmp=None):
     """
     Extrae metadatos específicos de imágenes 360
+    Si se pasan la imagen abierta, su EXIF y su XMP se reutilizan en lugar de volver a abrir el archivo
     """
     metadata_360 = {}
     
     try:
-        with Image.open(image_path) as img:
-            # Verificar si es una imagen 360 por sus metadatos XMP o dimensiones
-            if hasattr(img, '_getexif'):
-                exif = img._getexif()
-                if exif:
-                    # Buscar metadatos específicos de 360
-                    for tag_id, value in exif.items():
-                        tag = TAGS.get(tag_id, tag_id)
-                        if 'ProjectionType' in str(tag) or 'spherical' in str(value).lower():
-                            metadata_360['Is360Image'] = True
-                        if 'UsePanoramaViewer' in str(tag):
-                            metadata_360['UsePanoramaViewer'] = value
-            
-            # Verificar dimensiones típicas de imágenes 360 (relación 2:1)
-            width, height = img.size
-            aspect_ratio = width / height
-            if abs(aspect_ratio - 2.0) < 0.1:  # Tolerancia para relación 2:1
-                metadata_360['PossibleEquirectangular'] = True
-                metadata_360['AspectRatio'] = aspect_ratio
-            
-            metadata_360['ImageSize'] = f"{width}x{height}"
+        if img is None:
+            with Image.open(image_path) as img:
+                return extract_360_metadata(image_path, img, read_exif(img), read_xmp(img))
+        
+        # Verificar si es una imagen 360 por sus metadatos (EXIF y XMP GPano) o dimensiones
+        tag_name = TAGS.get
+        tags = [(tag_name(tag_id, tag_id), value) for tag_id, value in exif.items()] if exif else []
+        if xmp:
+            tags.extend(xmp.items())
+        # Buscar metadatos específicos de 360
+        for tag, value in tags:
+            if 'ProjectionType' in str(tag) or 'spherical' in str(value).lower():
+                metadata_360['Is360Image'] = True
+            if 'UsePanoramaViewer' in str(tag):
+                metadata_360['UsePanoramaViewer'] = value
+        
+        # Verificar dimensiones típicas de imágenes 360 (relación 2:1)
+        width, height = img.size
+        aspect_ratio = width / height
+        if abs(aspect_ratio - 2.0) < 0.1:  # Tolerancia para relación 2:1
+            metadata_360['PossibleEquirectangular'] = True
+            metadata_360['AspectRatio'] = aspect_ratio
+        
+        metadata_360['ImageSize'] = f"{width}x{height}"
             
     except Exception as e:
         print(f"Error al procesar metadatos 360: {e}")
     
     return metadata_360
 
-def extract_all_metadata(image_path):
+def metadata_cache_path(image_path, cache_dir, st):
+    """
+    Ruta en cache_dir de los metadatos de una imagen (st: su os.stat); la clave incluye
+    la fecha de modificación y el tamaño, así que un archivo modificado no reutiliza la caché
+    """
+    key = f"{os.path.abspath(image_path)}:{st.st_mtime_ns}:{st.st_size}"
+    return os.path.join(cache_dir, hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + '.json')
+
+def extract_all_metadata(image_path, cache_dir=None):
     """
     Extrae todos los metadatos disponibles de la imagen incluyendo datos de altura
+    Con cache_dir los metadatos se guardan en disco y se reutilizan mientras la imagen no cambie
     """
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"La imagen no existe: {image_path}")
+    # Un solo stat para la comprobación de existencia, el tamaño y la clave de caché
+    try:
+        st = os.stat(image_path)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"La imagen no existe: {image_path}") from None
+    
+    cache_path = None
+    if cache_dir:
+        cache_path = metadata_cache_path(image_path, cache_dir, st)
+        if os.path.isfile(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    data = f.read()
+                metadata = orjson.loads(data) if orjson is not None else json.loads(data)
+                # La caché es por contenido: ruta y hora de extracción son las de esta llamada
+                metadata['file_path'] = image_path
+                metadata['extraction_time'] = datetime.now().isoformat()
+                return metadata
+            except Exception:
+                pass  # Caché ilegible o corrupta: se vuelve a extraer
     
     metadata = {
         'file_path': image_path,
-        'file_size': os.path.getsize(image_path),
+        'file_size': st.st_size,
         'extraction_time': datetime.now().isoformat(),
         'has_gps_data': False,
         'gps_coordinates': None,
@@ -245,18 +427,16 @@ def extract_all_metadata(image_path):
             metadata['mode'] = img.mode
             metadata['size'] = img.size
             
-            # Extraer metadatos EXIF
-            exif_data = img._getexif()
+            # Extraer metadatos EXIF (una sola lectura, reutilizada para los metadatos 360)
+            exif_data = read_exif(img)
+            xmp_data = read_xmp(img)
             if exif_data:
-                for tag_id, value in exif_data.items():
-                    tag = TAGS.get(tag_id, tag_id)
-                    # Convertir valores no serializables a string
-                    if isinstance(value, bytes):
-                        try:
-                            value = value.decode('utf-8')
-                        except:
-                            value = str(value)
-                    metadata['exif_data'][tag] = value
+                tag_name = TAGS.get
+                # Convertir valores no serializables (bytes) a string
+                metadata['exif_data'] = {
+                    tag_name(tag_id, tag_id): decode_exif_bytes(value) if isinstance(value, bytes) else value
+                    for tag_id, value in exif_data.items()
+                }
                 
                 # Extraer datos GPS
                 gps_data = extract_gps_data(metadata['exif_data'])
@@ -271,144 +451,197 @@ def extract_all_metadata(image_path):
                             'longitude': gps_data['DecimalLongitude'],
                             'altitude': gps_data.get('DecimalAltitude', None)
                         }
-                
-                # Extraer datos de altura de la cámara
-                metadata['camera_height_data'] = extract_camera_height_data(metadata['exif_data'])
-            
+
+            # Extraer datos de altura de la cámara (EXIF y/o XMP: hay archivos con XMP y sin EXIF)
+            if exif_data or xmp_data:
+                metadata['camera_height_data'] = extract_camera_height_data(metadata['exif_data'], xmp_data)
+
             # Extraer metadatos específicos de 360
-            metadata['metadata_360'] = extract_360_metadata(image_path)
+            metadata['metadata_360'] = extract_360_metadata(image_path, img, exif_data, xmp_data)
             
     except Exception as e:
         print(f"Error al procesar la imagen: {e}")
         return None
     
+    if cache_path:
+        # Un fallo al escribir la caché no invalida unos metadatos ya extraídos
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(encode_metadata_json(metadata, indent=False))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Aviso: no se pudo guardar la caché en {cache_dir}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    
     return metadata
 
+def extract_all_metadata_batch(image_paths, workers=None, cache_dir=None):
+    """
+    Extrae los metadatos de varias imágenes en paralelo (un proceso por núcleo)
+    Devuelve la lista de metadatos en el mismo orden (None para las que fallen)
+    """
+    image_paths = list(image_paths)
+    extract = partial(extract_all_metadata, cache_dir=cache_dir)
+    if len(image_paths) <= 1:
+        return [extract(path) for path in image_paths]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        return list(executor.map(extract, image_paths, chunksize=8))
+
 def print_metadata_summary(metadata):
     """
     Imprime un resumen de los metadatos extraídos incluyendo información de altura
+    Las líneas se acumulan y se escriben en stdout de una sola vez
     """
-    print("=" * 60)
-    print("RESUMEN DE METADATOS DE IMAGEN 360")
-    print("=" * 60)
-    print(f"Archivo: {metadata['file_path']}")
-    print(f"Tamaño: {metadata['file_size']} bytes")
-    print(f"Formato: {metadata['format']}")
-    print(f"Dimensiones: {metadata['size'][0]}x{metadata['size'][1]}")
+    lines = []
+    emit = lines.append
+    emit("=" * 60)
+    emit("RESUMEN DE METADATOS DE IMAGEN 360")
+    emit("=" * 60)
+    emit(f"Archivo: {metadata['file_path']}")
+    emit(f"Tamaño: {metadata['file_size']} bytes")
+    emit(f"Formato: {metadata['format']}")
+    emit(f"Dimensiones: {metadata['size'][0]}x{metadata['size'][1]}")
     
     # Información sobre imagen 360
-    print("\n--- INFORMACIÓN 360 ---")
+    emit("\n--- INFORMACIÓN 360 ---")
     if metadata['metadata_360']:
         for key, value in metadata['metadata_360'].items():
-            print(f"{key}: {value}")
+            emit(f"{key}: {value}")
     else:
-        print("No se detectaron metadatos específicos de imagen 360")
+        emit("No se detectaron metadatos específicos de imagen 360")
     
     # Información GPS
-    print("\n--- INFORMACIÓN DE GEOLOCALIZACIÓN ---")
+    emit("\n--- INFORMACIÓN DE GEOLOCALIZACIÓN ---")
     if metadata['has_gps_data']:
-        print("✅ La imagen CONTIENE datos de geolocalización")
+        emit("✅ La imagen CONTIENE datos de geolocalización")
         if metadata['gps_coordinates']:
             coords = metadata['gps_coordinates']
-            print(f"Latitud: {coords['latitude']:.6f}")
-            print(f"Longitud: {coords['longitude']:.6f}")
+            emit(f"Latitud: {coords['latitude']:.6f}")
+            emit(f"Longitud: {coords['longitude']:.6f}")
             if coords['altitude']:
-                print(f"Altitud GPS: {coords['altitude']:.2f} metros sobre el nivel del mar")
+                emit(f"Altitud GPS: {coords['altitude']:.2f} metros sobre el nivel del mar")
             
             # Generar enlace a Google Maps
             lat, lon = coords['latitude'], coords['longitude']
             maps_url = f"https://www.google.com/maps?q={lat},{lon}"
-            print(f"Ver en Google Maps: {maps_url}")
+            emit(f"Ver en Google Maps: {maps_url}")
     else:
-        print("❌ La imagen NO contiene datos de geolocalización")
+        emit("❌ La imagen NO contiene datos de geolocalización")
     
     # Nueva sección: Información de altura de la cámara
-    print("\n--- INFORMACIÓN DE ALTURA DE LA CÁMARA ---")
+    emit("\n--- INFORMACIÓN DE ALTURA DE LA CÁMARA ---")
     height_data = metadata.get('camera_height_data', {})
     
     if height_data.get('sources_found'):
-        print("✅ Se encontraron datos de altura de la cámara:")
-        print(f"Fuentes detectadas: {', '.join(height_data['sources_found'])}")
+        emit("✅ Se encontraron datos de altura de la cámara:")
+        emit(f"Fuentes detectadas: {', '.join(height_data['sources_found'])}")
         
         # Mostrar estimaciones de altura
         if height_data.get('height_estimates'):
-            print("\n🔍 Estimaciones de altura:")
+            emit("\n🔍 Estimaciones de altura:")
             for key, data in height_data['height_estimates'].items():
-                print(f"  • {data['description']}: {data['value']} {data.get('unit', 'metros')}")
+                emit(f"  • {data['description']}: {data['value']} {data.get('unit', 'metros')}")
                 if 'reference' in data:
-                    print(f"    Referencia: {data['reference']}")
+                    emit(f"    Referencia: {data['reference']}")
         
         # Mostrar datos de vuelo (drones)
         if height_data.get('flight_data'):
-            print("\n🚁 Datos de vuelo de drone:")
+            emit("\n🚁 Datos de vuelo de drone:")
             for key, data in height_data['flight_data'].items():
-                print(f"  • {data['description']}: {data['value']}")
+                emit(f"  • {data['description']}: {data['value']}")
         
         # Mostrar datos de sensores
         if height_data.get('sensor_data'):
-            print("\n📱 Datos de sensores:")
+            emit("\n📱 Datos de sensores:")
             for sensor_type, data in height_data['sensor_data'].items():
                 if sensor_type == 'barometric':
-                    print(f"  • Sensor barométrico: {data['description']}")
+                    emit(f"  • Sensor barométrico: {data['description']}")
                 elif sensor_type == 'motion':
-                    print(f"  • Sensores de movimiento: {list(data.keys())}")
+                    emit(f"  • Sensores de movimiento: {list(data.keys())}")
         
         # Información del dispositivo
         if height_data.get('device_info'):
             device = height_data['device_info']
-            print(f"\n📷 Tipo de dispositivo detectado: {device.get('type', 'desconocido').upper()}")
+            emit(f"\n📷 Tipo de dispositivo detectado: {device.get('type', 'desconocido').upper()}")
             if 'typical_height_range' in device:
-                print(f"   Rango típico de altura: {device['typical_height_range']}")
+                emit(f"   Rango típico de altura: {device['typical_height_range']}")
                 
     else:
-        print("❌ No se encontraron datos específicos de altura de la cámara")
-        print("💡 Esto puede deberse a:")
-        print("   • La cámara no tiene sensores de altura")
-        print("   • Los metadatos no incluyen información de altura")
-        print("   • La imagen fue procesada y se perdieron los metadatos")
+        emit("❌ No se encontraron datos específicos de altura de la cámara")
+        emit("💡 Esto puede deberse a:")
+        emit("   • La cámara no tiene sensores de altura")
+        emit("   • Los metadatos no incluyen información de altura")
+        emit("   • La imagen fue procesada y se perdieron los metadatos")
         
         # Sugerir altura basada en el dispositivo
         if 'Make' in metadata.get('exif_data', {}):
             make = metadata['exif_data']['Make'].upper()
             model = metadata['exif_data'].get('Model', '').upper()
-            print(f"\n📱 Dispositivo: {make} {model}")
+            emit(f"\n📱 Dispositivo: {make} {model}")
             
-            if 'DJI' in make:
-                print("   Estimación: Probablemente tomada entre 20-120 metros (drone)")
-            elif 'GOPRO' in make or 'INSTA360' in make:
-                print("   Estimación: Probablemente tomada entre 1.5-4 metros (cámara de acción)")
-            elif any(brand in make for brand in ['APPLE', 'SAMSUNG', 'GOOGLE']):
-                print("   Estimación: Probablemente tomada entre 1.2-2 metros (smartphone)")
+            # El tipo ya se detectó en extract_camera_height_data
+            hint = DEVICE_HEIGHT_HINTS.get(height_data.get('device_info', {}).get('type'))
+            if hint:
+                emit(f"   Estimación: {hint}")
     
     # Otros metadatos EXIF relevantes
-    print("\n--- OTROS METADATOS RELEVANTES ---")
+    emit("\n--- OTROS METADATOS RELEVANTES ---")
     relevant_tags = ['DateTime', 'Make', 'Model', 'Software', 'ImageDescription']
     for tag in relevant_tags:
         if tag in metadata['exif_data']:
-            print(f"{tag}: {metadata['exif_data'][tag]}")
+            emit(f"{tag}: {metadata['exif_data'][tag]}")
     
     # Consejos adicionales
-    print("\n--- CONSEJOS PARA OBTENER DATOS DE ALTURA ---")
-    print("💡 Para obtener datos más precisos de altura:")
-    print("   • Usar drones con GPS y barómetro")
-    print("   • Activar el GPS en smartphones antes de tomar la foto")
-    print("   • Usar aplicaciones especializadas que registren datos de sensores")
-    print("   • Verificar que los metadatos no hayan sido eliminados por redes sociales")
+    emit("\n--- CONSEJOS PARA OBTENER DATOS DE ALTURA ---")
+    emit("💡 Para obtener datos más precisos de altura:")
+    emit("   • Usar drones con GPS y barómetro")
+    emit("   • Activar el GPS en smartphones antes de tomar la foto")
+    emit("   • Usar aplicaciones especializadas que registren datos de sensores")
+    emit("   • Verificar que los metadatos no hayan sido eliminados por redes sociales")
+    
+    sys.stdout.write("\n".join(lines) + "\n")
+
+
+def encode_metadata_json(metadata, indent=True):
+    """
+    Serializa los metadatos a JSON (bytes UTF-8); los valores no serializables
+    (p. ej. IFDRational) se guardan como texto
+    """
+    if orjson is not None:
+        # Las etiquetas EXIF desconocidas tienen claves enteras: OPT_NON_STR_KEYS las convierte a texto
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(metadata, default=str, option=option)
+    return json.dumps(metadata, indent=2 if indent else None, ensure_ascii=False, default=str).encode('utf-8')
+
 def save_metadata_json(metadata, output_path):
     """
     Guarda los metadatos completos en un archivo JSON
     """
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False, default=str)
+        with open(output_path, 'wb') as f:
+            f.write(encode_metadata_json(metadata))
         print(f"\nMetadatos completos guardados en: {output_path}")
     except Exception as e:
         print(f"Error al guardar JSON: {e}")
 
+def list_images(directory):
+    """
+    Devuelve, ordenadas, las rutas de las imágenes de un directorio
+    """
+    with os.scandir(directory) as entries:
+        return sorted(e.path for e in entries
+                      if e.is_file() and e.name.lower().endswith(IMAGE_EXTENSIONS))
+
 def main():
     if len(sys.argv) < 2:
-        print("Uso: python script.py <ruta_imagen> [--json output.json]")
+        print("Uso: python script.py <ruta_imagen|directorio> [--json output.json] [--cache-dir DIR] [--gps-only] [-q|--quiet]")
         print("Ejemplo: python script.py imagen360.jpg --json metadatos.json")
+        print("Ejemplo: python script.py imagenes/ --json metadatos.json")
         return
     
     image_path = sys.argv[1]
@@ -425,12 +658,46 @@ def main():
             json_output = 'metadata.json'
             save_json = True
     
+    # Caché opcional de metadatos en disco (por ruta, fecha de modificación y tamaño)
+    cache_dir = None
+    if '--cache-dir' in sys.argv:
+        cache_index = sys.argv.index('--cache-dir')
+        if cache_index + 1 < len(sys.argv):
+            cache_dir = sys.argv[cache_index + 1]
+    
+    # Sin resumen por consola (solo JSON); en un directorio con --json es lo predeterminado
+    quiet = '--quiet' in sys.argv or '-q' in sys.argv or (save_json and os.path.isdir(image_path))
+    
+    # Solo coordenadas GPS: lectura rápida de las cabeceras, sin el resto de metadatos
+    if '--gps-only' in sys.argv:
+        for path in (list_images(image_path) if os.path.isdir(image_path) else [image_path]):
+            try:
+                coords = fast_gps_only(path)
+            except OSError as e:
+                print(f"{path}: Error: {e}")
+                continue
+            print(f"{path}: {coords[0]:.6f}, {coords[1]:.6f}" if coords else f"{path}: sin datos GPS")
+        return
+    
+    # Directorio: todas las imágenes en paralelo, con un único JSON (lista de metadatos)
+    if os.path.isdir(image_path):
+        paths = list_images(image_path)
+        results = [m for m in extract_all_metadata_batch(paths, cache_dir=cache_dir) if m]
+        if not quiet:
+            for metadata in results:
+                print_metadata_summary(metadata)
+        print(f"\nMetadatos extraídos de {len(results)}/{len(paths)} imágenes")
+        if save_json and results:
+            save_metadata_json(results, json_output)
+        return
+    
     try:
         # Extraer metadatos
-        metadata = extract_all_metadata(image_path)
+        metadata = extract_all_metadata(image_path, cache_dir)
         if metadata:
             # Mostrar resumen
-            print_metadata_summary(metadata)
+            if not quiet:
+                print_metadata_summary(metadata)
             
             # Guardar JSON si se solicita
             if save_json: